@@ -44,6 +44,7 @@ setup(
     ],},
     author="Jordan Matelsky",
     install_requires=install_requires,
+    extras_require={"fast": ["orjson"], "arrow": ["connectorx", "pyarrow"]},
     dependency_links=dependency_links,
     author_email="jordan@matelsky.com",
 )
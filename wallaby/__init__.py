@@ -1,24 +1,438 @@
-from typing import List, Union
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Set, Tuple, Union
 
+import contextlib
+import hashlib
 import os
+import string
 import json
 import sqlite3
 import sys
+import threading
 import time
+from urllib.request import pathname2url
 
 import pandas as pd
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 _DEFAULT_SQLITE_PATH = "~/wallaby.db"
 
+# Tag queries are fully parameterized, so their SQL text only varies with the
+# shape of the query. Keep enough of those compiled statements around:
+_CACHED_STATEMENTS = 512
+
+# Statements run on every write. Keeping the exact same text lets sqlite3
+# reuse the compiled statement from its cache:
+_INSERT_SQL = """
+    INSERT INTO results(jobtext, tagscsv, date, results, tagset_hash)
+    VALUES(?, ?, ?, ?, ?)
+"""
+_INSERT_TAG_SQL = "INSERT INTO tags(result_id, tag) VALUES(?, ?)"
+
+# How many bytes of command output `cli` echoes at a time:
+_TEE_CHUNK_SIZE = 64 * 1024
+
+# Relative costs of WHERE predicates, used to order them cheapest first:
+_RANK_EQUALITY = 0  # `=` on an indexed column
+_RANK_RANGE = 1  # range on an indexed column
+_RANK_SUBQUERY = 2  # membership in an (indexed) subquery
+_RANK_SCAN = 3  # anything that must be checked row by row, e.g. `LIKE '%x%'`
+
+# How many rows to pull from SQLite at a time when streaming results:
+_FETCH_CHUNK_SIZE = 1000
+
+# Open connections, shared by every Wallaby pointing at the same database from
+# the same thread, so that creating a Wallaby per call does not reopen the
+# database file. sqlite3 connections may not cross threads by default, so
+# they live in thread-local storage (see `_thread_conns`), which also closes
+# them when their thread exits:
+_CONNS = threading.local()
+
+# Databases whose schema has already been provisioned by this process:
+_SCHEMA_READY: Set[str] = set()
+
+# Applied to every new connection:
+_CONNECTION_PRAGMAS = [
+    "temp_store=MEMORY",
+    "cache_size=-64000",
+]
+
+# Applied to new connections of a Wallaby created with wal=True. WAL lets
+# readers proceed alongside a writer, and with WAL, synchronous=NORMAL is
+# still safe against corruption. WAL and mmap both rely on memory shared
+# between processes on one host, so they are unsafe on network filesystems
+# (e.g. NFS home directories on a cluster) and are not the default:
+_WAL_PRAGMAS = [
+    "journal_mode=WAL",
+    "synchronous=NORMAL",
+    "mmap_size=268435456",
+]
+
+# Applied inside `Wallaby.bulk_mode`:
+_BULK_MODE_PRAGMAS = {
+    "journal_mode": "OFF",
+    "synchronous": "OFF",
+    "foreign_keys": "OFF",
+}
+
+
+def _json_dumps(obj) -> str:
+    """
+    Serialize results to JSON text, using orjson if it is installed.
+
+    Arguments:
+        obj: The JSON-serializable object
+
+    Returns:
+        str: The JSON text
+
+    """
+    if orjson is None:
+        return json.dumps(obj)
+    try:
+        # Decode so the column still holds TEXT (and works with SQLite's json_*):
+        return orjson.dumps(
+            obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        ).decode()
+    except orjson.JSONEncodeError:
+        # orjson rejects some values the standard library accepts, such as
+        # integers wider than 64 bits and strings with lone surrogates (which
+        # os.environ can contain):
+        return json.dumps(obj)
+
+
+def _json_loads(text: str):
+    """
+    Parse JSON text, using orjson if it is installed.
+
+    Arguments:
+        text (str): The JSON text
+
+    Returns:
+        The parsed object
+
+    """
+    if orjson is None:
+        return json.loads(text)
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        # Text written by the standard library may hold NaN or escaped lone
+        # surrogates, which orjson refuses to parse:
+        return json.loads(text)
+
+
+def _iter_chunks(
+    cursor: sqlite3.Cursor, chunk_size: int = _FETCH_CHUNK_SIZE
+) -> Iterator[List[tuple]]:
+    """
+    Iterate over a cursor's rows in lists of at most chunk_size rows.
+
+    Arguments:
+        cursor (sqlite3.Cursor): The cursor of an executed query
+        chunk_size (int): How many rows to fetch at a time
+
+    Returns:
+        Iterator[List[tuple]]: The chunks of rows
+
+    """
+    return iter(lambda: cursor.fetchmany(chunk_size), [])
+
+
+def _downcast(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Shrink the id and date columns of a results DataFrame in place.
+
+    Ids become the smallest unsigned integer type that fits them, and dates
+    become float32 only if that loses no precision (which, for absolute unix
+    timestamps, it usually does, so those stay float64).
+
+    Arguments:
+        df (pd.DataFrame): The results DataFrame
+
+    Returns:
+        pd.DataFrame: The same DataFrame
+
+    """
+    if "id" in df.columns:
+        df["id"] = pd.to_numeric(df["id"], downcast="unsigned")
+    if "date" in df.columns:
+        df["date"] = pd.to_numeric(df["date"], downcast="float")
+    return df
+
+
+def _thread_conns() -> Dict[Tuple[str, bool, bool], sqlite3.Connection]:
+    """
+    Get the current thread's open connections, keyed by _connection_key.
+
+    Arguments:
+        None
+
+    Returns:
+        Dict[Tuple[str, bool, bool], sqlite3.Connection]: The connections
+
+    """
+    try:
+        return _CONNS.conns
+    except AttributeError:
+        _CONNS.conns = {}
+        return _CONNS.conns
+
+
+def _connection_key(
+    path: str, readonly: bool = False, wal: bool = False
+) -> Union[Tuple[str, bool, bool], None]:
+    """
+    Get the key under which a database's connection is shared in _CONNS.
+
+    Arguments:
+        path (str): The (user-expanded) database path
+        readonly (bool): Whether the connection is read-only
+        wal (bool): Whether the connection uses write-ahead logging
+
+    Returns:
+        Tuple[str, bool, bool]: The resolved path and readonly and wal flags,
+            or None if the database is a private in-memory one that cannot be
+            shared
+
+    """
+    if path in ("", ":memory:"):
+        return None
+    if not path.startswith("file:"):
+        path = os.path.realpath(path)
+    return (path, readonly, wal)
+
+
+def _readonly_uri(path: str) -> str:
+    """
+    Build a SQLite URI that opens a database in read-only mode.
+
+    Arguments:
+        path (str): The (user-expanded) database path or `file:` URI
+
+    Returns:
+        str: The URI, to be passed to sqlite3.connect with uri=True
+
+    """
+    if not path.startswith("file:"):
+        path = "file:" + pathname2url(os.path.abspath(path))
+    return path + ("&" if "?" in path else "?") + "mode=ro"
+
+
+# SQLite's NOCASE collation only folds ASCII letters, so tags are compared
+# case-insensitively in ASCII only; fold the same way on the Python side:
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def _ascii_lower(text: str) -> str:
+    """
+    Lowercase the ASCII letters of a string, the way SQLite's NOCASE does.
+
+    Arguments:
+        text (str): The string to fold
+
+    Returns:
+        str: The string, with only A-Z lowercased
+
+    """
+    return text.translate(_ASCII_LOWER)
+
+
+def _prefix_upper_bound(prefix: str) -> Union[str, None]:
+    """
+    Compute the smallest string greater than every string starting with prefix.
+
+    Arguments:
+        prefix (str): A tag prefix, folded with _ascii_lower
+
+    Returns:
+        str: The exclusive upper bound, or None if there is no such bound
+
+    """
+    while prefix:
+        last = ord(prefix[-1]) + 1
+        if 0xD800 <= last <= 0xDFFF:
+            # Surrogates cannot be encoded to UTF-8; skip past them:
+            last = 0xE000
+        if last <= sys.maxunicode:
+            return prefix[:-1] + chr(last)
+        prefix = prefix[:-1]
+    return None
+
+
+def _tag_term(tag: str) -> Tuple[int, str, tuple]:
+    """
+    Build a subquery selecting the ids of results that carry a tag.
+
+    Tags ending in `*` are treated as prefixes and matched with a range
+    predicate (`tag >= ? AND tag < ?`) so that the NOCASE index on tags.tag
+    is used; a `LIKE 'prefix%'` pattern would only use it under specific
+    planner conditions. The empty tag matches results that have no tags at
+    all. All other tags use an equality lookup.
+
+    Arguments:
+        tag (str): The tag (or `prefix*` pattern) to match
+
+    Returns:
+        Tuple[int, str, tuple]: The term's cost rank (see `_where`), and the
+            SQL subquery and its bound parameters
+
+    """
+    if tag == "":
+        # Untagged results all share the tag set ",,", so seek its hash (and
+        # rule out collisions) rather than probing the tags table per row:
+        return (
+            _RANK_EQUALITY,
+            "SELECT id FROM results WHERE tagset_hash = ? AND tagscsv = ?",
+            (_tagset_hash(",,"), ",,"),
+        )
+    if not tag.endswith("*"):
+        return _RANK_EQUALITY, "SELECT result_id FROM tags WHERE tag = ?", (tag,)
+    # NOCASE folds ASCII to lowercase, so the bounds must be folded too:
+    prefix = _ascii_lower(tag[:-1])
+    upper = _prefix_upper_bound(prefix)
+    if upper is None:
+        return _RANK_RANGE, "SELECT result_id FROM tags WHERE tag >= ?", (prefix,)
+    return (
+        _RANK_RANGE,
+        "SELECT result_id FROM tags WHERE tag >= ? AND tag < ?",
+        (prefix, upper),
+    )
+
+
+def _tag_query(
+    all_of: Union[List[str], str] = None, any_of: Union[List[str], str] = None
+) -> Tuple[str, tuple]:
+    """
+    Build a subquery selecting the ids of results that match a tag query.
+
+    Arguments:
+        all_of (Union[List[str], str]): Tags that must all be present
+        any_of (Union[List[str], str]): Tags of which any must be present
+
+    Returns:
+        Tuple[str, tuple]: The SQL subquery and its bound parameters
+
+    """
+    if all_of:
+        set_operation = " INTERSECT "
+    elif any_of:
+        set_operation = " UNION "
+    else:
+        raise ValueError("You must specify exactly one of `any_of` or `all_of`.")
+
+    taglist = all_of if all_of else any_of
+
+    if isinstance(taglist, str):
+        taglist = [taglist]
+    # Put exact tags first, so INTERSECT starts from the smallest id sets:
+    terms = sorted((_tag_term(t) for t in taglist), key=lambda term: term[0])
+    tag_clause = set_operation.join(sql for _, sql, _ in terms)
+    params = tuple(p for _, _, term_params in terms for p in term_params)
+    return tag_clause, params
+
+
+def _where(predicates: List[Tuple[int, str, tuple]]) -> Tuple[str, tuple]:
+    """
+    Join predicates into a WHERE clause, cheapest first.
+
+    SQLite evaluates the terms of a WHERE clause left to right when it cannot
+    satisfy them all from an index, so cheap, selective predicates on indexed
+    columns should come before ones that need a subquery or a scan.
+
+    Arguments:
+        predicates (List[Tuple[int, str, tuple]]): (rank, SQL, parameters)
+            triples, where rank is one of the _RANK_* costs
+
+    Returns:
+        Tuple[str, tuple]: The SQL condition and its bound parameters
+
+    """
+    predicates = sorted(predicates, key=lambda predicate: predicate[0])
+    clause = " AND ".join(f"({sql})" for _, sql, _ in predicates)
+    params = tuple(p for _, _, predicate_params in predicates for p in predicate_params)
+    return clause, params
+
+
+def _split_tagscsv(tagscsv: str) -> List[str]:
+    """
+    Split a stored tagscsv value (e.g. ",foo,bar,") into its distinct tags.
+
+    Arguments:
+        tagscsv (str): The comma-wrapped CSV of tags
+
+    Returns:
+        List[str]: The tags, in order, without duplicates or empty entries
+
+    """
+    tags, seen = [], set()
+    for tag in (tagscsv or "").split(","):
+        if tag and _ascii_lower(tag) not in seen:
+            seen.add(_ascii_lower(tag))
+            tags.append(tag)
+    return tags
+
+
+def _canonical_tagscsv(tags: List[str] = None) -> str:
+    """
+    Build the canonical tagscsv for a set of tags, e.g. ",bar,foo,".
+
+    Tags are deduplicated and sorted case-insensitively (in ASCII only, like
+    the NOCASE collation), so that any two equal tag sets are stored
+    identically.
+
+    Arguments:
+        tags (List[str]): The tags
+
+    Returns:
+        str: The comma-wrapped CSV of tags
+
+    """
+    tags = sorted(_split_tagscsv(",".join(tags or [])), key=_ascii_lower)
+    return "," + ",".join(tags) + ","
+
+
+def _tagset_hash(tagscsv: str) -> int:
+    """
+    Hash a canonical tagscsv to a stable, signed 64-bit integer.
+
+    Arguments:
+        tagscsv (str): The canonical tagscsv, see _canonical_tagscsv
+
+    Returns:
+        int: The hash, which fits in an SQLite INTEGER
+
+    """
+    digest = hashlib.blake2b(_ascii_lower(tagscsv).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
 
 class Wallaby:
-    def __init__(self, sqlite_database_path: str = _DEFAULT_SQLITE_PATH):
+    def __init__(
+        self,
+        sqlite_database_path: str = _DEFAULT_SQLITE_PATH,
+        readonly: bool = False,
+        wal: bool = False,
+    ):
         """
         Create a new pointer to a Wallaby database.
 
         Arguments:
             sqlite_database_path (str): Path for the Wallaby database. Defaults
                 to wallaby._DEFAULT_SQLITE_PATH.
+            readonly (bool: False): Open the database read-only. Read-only
+                Wallabys cannot log, but many of them can read concurrently
+                alongside a writer. If the database does not exist yet, or
+                was created by an older version of Wallaby, it is provisioned
+                once with a read-write connection first.
+            wal (bool: False): Use write-ahead logging and memory-mapped I/O,
+                which are faster and let readers run alongside a writer. Only
+                use this when every process using the database runs on the
+                same machine: WAL does not work on network filesystems such
+                as NFS. The journal mode is stored in the database file.
 
         Returns:
             None
@@ -26,22 +440,208 @@ class Wallaby:
         """
         self._columns = {
             "jobtext": "TEXT",
-            "tagscsv": "TEXT",
+            "tagscsv": "TEXT COLLATE NOCASE",
             "date": "FLOAT",
             "results": "JSON",
         }
         self._sqlite_database_path = os.path.expanduser(sqlite_database_path)
+        self._readonly = readonly
+        self._wal = wal
+        # Resolving the path hits the filesystem, so do it once rather than
+        # on every query:
+        self._key = _connection_key(self._sqlite_database_path, readonly, wal)
         self._conn = None
-        self._initialize()
+        if not readonly:
+            self._initialize()
+        elif not self._schema_is_current():
+            # Provision with a short-lived read-write connection:
+            writer = Wallaby(self._sqlite_database_path, wal=wal)
+            writer.close()
+            if self._key is not None:
+                _SCHEMA_READY.add(self._key[0])
 
-    def _cursor(self):
-        self._conn = self._conn or sqlite3.connect(self._sqlite_database_path)
-        return self._conn.cursor()
+    def _schema_is_current(self) -> bool:
+        """
+        Check whether the database exists and has the current schema.
+
+        Arguments:
+            None
+
+        Returns:
+            Bool: True if the database can be queried without provisioning.
+
+        """
+        path = self._sqlite_database_path
+        key = self._key
+        if key is not None and key[0] in _SCHEMA_READY:
+            return True
+        if not path.startswith("file:") and not os.path.exists(path):
+            return False
+        tables = {
+            name
+            for (name,) in self._execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"
+            )
+        }
+        if not {"results", "tags"} <= tables:
+            return False
+        columns = [row[1] for row in self._execute("PRAGMA table_info(results)")]
+        if "tagset_hash" not in columns:
+            return False
+        if key is not None:
+            _SCHEMA_READY.add(key[0])
+        return True
+
+    def _open(self) -> sqlite3.Connection:
+        # Transactions are managed explicitly (see `_transaction`), so run the
+        # connection in autocommit mode rather than sqlite3's implicit BEGINs:
+        if self._readonly:
+            conn = sqlite3.connect(
+                _readonly_uri(self._sqlite_database_path),
+                cached_statements=_CACHED_STATEMENTS,
+                isolation_level=None,
+                uri=True,
+            )
+        else:
+            conn = sqlite3.connect(
+                self._sqlite_database_path,
+                cached_statements=_CACHED_STATEMENTS,
+                isolation_level=None,
+            )
+        pragmas = _CONNECTION_PRAGMAS + (_WAL_PRAGMAS if self._wal else [])
+        for pragma in pragmas:
+            # A read-only connection cannot change the journal mode; it reads
+            # whichever mode the writer set:
+            if not (self._readonly and pragma.startswith("journal_mode")):
+                conn.execute(f"PRAGMA {pragma}")
+        return conn
+
+    def _connection(self) -> sqlite3.Connection:
+        key = self._key
+        if key is None:
+            # A private in-memory database lives only as long as its own
+            # connection, so it is never shared:
+            if self._conn is None:
+                self._conn = self._open()
+            return self._conn
+        conns = _thread_conns()
+        if key not in conns:
+            conns[key] = self._open()
+        return conns[key]
+
+    def close(self):
+        """
+        Close this thread's connection to the database.
+
+        Every Wallaby on this thread pointing at the same database shares the
+        connection; they will transparently reopen it if used again.
+
+        Arguments:
+            None
+
+        Returns:
+            None
+
+        """
+        key = self._key
+        if key is None:
+            conn, self._conn = self._conn, None
+        else:
+            conn = _thread_conns().pop(key, None)
+            # The file may be deleted or replaced after this, so provision
+            # the schema again the next time it is opened:
+            _SCHEMA_READY.discard(key[0])
+        if conn is not None:
+            conn.close()
+
+    @contextlib.contextmanager
+    def bulk_mode(self):
+        """
+        Disable journaling and syncing for the duration of a bulk write.
+
+        This is much faster for large rebuilds or imports, but a crash while
+        inside the block can corrupt the database. The previous settings are
+        restored on exit.
+
+        Arguments:
+            None
+
+        Returns:
+            None
+
+        """
+        self._connection()
+        self.commit()
+        previous = {
+            pragma: self._execute(f"PRAGMA {pragma}").fetchone()[0]
+            for pragma in _BULK_MODE_PRAGMAS
+        }
+        for pragma, value in _BULK_MODE_PRAGMAS.items():
+            self._execute(f"PRAGMA {pragma}={value}")
+        try:
+            yield self
+        finally:
+            self.commit()
+            for pragma, value in previous.items():
+                self._execute(f"PRAGMA {pragma}={value}")
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """
+        Run the enclosed statements in one transaction.
+
+        The transaction is committed on success and rolled back on error. It
+        takes the write lock up front (BEGIN IMMEDIATE): a deferred
+        transaction that reads before it writes cannot wait for the lock, so
+        concurrent jobs would fail with "database is locked". Inside a
+        transaction the caller opened with `raw_query("BEGIN")`, a SAVEPOINT
+        is used instead, and nothing is committed until the caller calls
+        `commit`.
+
+        Arguments:
+            None
+
+        Returns:
+            None
+
+        """
+        conn = self._connection()
+        if conn.in_transaction:
+            conn.execute("SAVEPOINT wallaby")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK TO wallaby")
+                conn.execute("RELEASE wallaby")
+                raise
+            conn.execute("RELEASE wallaby")
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
 
     def _execute(self, query: str, *args, **kwargs):
-        results = self._cursor().execute(query, *args, **kwargs)
-        self._conn.commit()
-        return results
+        return self._connection().execute(query, *args, **kwargs)
+
+    def commit(self):
+        """
+        Commit the current transaction, if any.
+
+        Statements are committed as they run, so this is only needed to close
+        a transaction opened explicitly with `raw_query("BEGIN")`.
+
+        Arguments:
+            None
+
+        Returns:
+            None
+
+        """
+        self._connection().commit()
 
     def _initialize(self):
         """
@@ -54,40 +654,301 @@ class Wallaby:
             Bool: True if successful.
 
         """
+        schema_key = self._key
+        if schema_key is not None and schema_key[0] in _SCHEMA_READY:
+            return True
         kv = ",\n".join(f"{k} {v}" for k, v in self._columns.items())
+        # tagset_hash is internal (see `get_by_exact_tagset`), so it is not
+        # one of the public self._columns:
         new_table_cmd = f"""
         CREATE TABLE IF NOT EXISTS results (
             id INTEGER PRIMARY KEY,
-            {kv}
+            {kv},
+            tagset_hash INTEGER
         );
         """
-        self._execute(new_table_cmd)
+        with self._transaction():
+            has_tags_table = self._execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tags'"
+            ).fetchone()
+            self._execute(new_table_cmd)
+            self._execute(
+                "CREATE INDEX IF NOT EXISTS results_date_idx ON results(date);"
+            )
+            self._execute(
+                """
+                CREATE TABLE IF NOT EXISTS tags (
+                    result_id INTEGER REFERENCES results(id),
+                    tag TEXT COLLATE NOCASE
+                );
+            """
+            )
+            # Index (tag, result_id) together so that the tag index works as
+            # an inverted index: tag lookups read ids straight from the index
+            # without touching the tags table. This supersedes the older
+            # tag-only index.
+            self._execute("DROP INDEX IF EXISTS tags_tag_idx;")
+            self._execute(
+                """
+                CREATE INDEX IF NOT EXISTS tags_tag_result_idx
+                ON tags(tag COLLATE NOCASE, result_id);
+            """
+            )
+            if not has_tags_table:
+                self._backfill_tags()
+            columns = [row[1] for row in self._execute("PRAGMA table_info(results)")]
+            if "tagset_hash" not in columns:
+                self._execute("ALTER TABLE results ADD COLUMN tagset_hash INTEGER;")
+                self._backfill_tagsets()
+            self._execute(
+                """
+                CREATE INDEX IF NOT EXISTS results_tagset_hash_idx
+                ON results(tagset_hash);
+            """
+            )
+        if schema_key is not None:
+            _SCHEMA_READY.add(schema_key[0])
         return True
 
-    def log(
+    def _backfill_tags(self):
+        """
+        Populate the tags table from the tagscsv column of existing rows.
+
+        Databases created before the tags table existed only carry the CSV
+        column, so copy those tags over once when the table is first created.
+
+        Arguments:
+            None
+
+        Returns:
+            None
+
+        """
+        rows = self._execute("SELECT id, tagscsv FROM results").fetchall()
+        self._connection().executemany(
+            _INSERT_TAG_SQL,
+            [(rid, tag) for rid, tagscsv in rows for tag in _split_tagscsv(tagscsv)],
+        )
+
+    def _backfill_tagsets(self):
+        """
+        Canonicalize the tagscsv and fill in the tagset_hash of existing rows.
+
+        Databases created before tagset_hash existed stored tags unsorted and
+        without a hash; bring them in line so `get_by_exact_tagset` finds them.
+
+        Arguments:
+            None
+
+        Returns:
+            None
+
+        """
+        rows = self._execute("SELECT id, tagscsv FROM results").fetchall()
+        updates = []
+        for rid, tagscsv in rows:
+            canonical = _canonical_tagscsv(_split_tagscsv(tagscsv))
+            updates.append((canonical, _tagset_hash(canonical), rid))
+        self._connection().executemany(
+            "UPDATE results SET tagscsv = ?, tagset_hash = ? WHERE id = ?", updates
+        )
+
+    def _row(
         self, results: Union[dict, str], tags: List[str] = None, jobtext: str = None
-    ):
+    ) -> tuple:
         jobtext = jobtext or " ".join(sys.argv[:])
-        tagscsv = "," + (",".join(tags) if tags else "") + ","
+        tagscsv = _canonical_tagscsv(tags)
         date = time.time()
         if isinstance(results, str):
             results = {"output": results}
-        results = json.dumps(results)
-        self._execute(
-            """
-            INSERT INTO
-                results(jobtext, tagscsv, date, results)
-            VALUES(?, ?, ?, ?)
-        """,
-            (jobtext, tagscsv, date, results),
-        )
+        results = _json_dumps(results)
+        return (jobtext, tagscsv, date, results, _tagset_hash(tagscsv))
+
+    def _insert(self, rows: Iterable[tuple]):
+        """
+        Insert result rows and their tags. Call inside `_transaction`.
+
+        Arguments:
+            rows (Iterable[tuple]): (jobtext, tagscsv, date, results,
+                tagset_hash) tuples
+
+        Returns:
+            None
+
+        """
+        conn = self._connection()
+        tag_rows = []
+        for row in rows:
+            result_id = conn.execute(_INSERT_SQL, row).lastrowid
+            tag_rows.extend((result_id, tag) for tag in _split_tagscsv(row[1]))
+        conn.executemany(_INSERT_TAG_SQL, tag_rows)
+
+    def log(
+        self, results: Union[dict, str], tags: List[str] = None, jobtext: str = None
+    ):
+        return self.log_many([results], tags=tags, jobtext=jobtext)
+
+    def log_many(
+        self,
+        items: Iterable[Union[dict, str]],
+        tags: List[str] = None,
+        jobtext: str = None,
+    ):
+        """
+        Log many results at once, in a single transaction.
+
+        This is much faster than calling `log` in a loop, since the database
+        is only synced to disk once for the whole batch.
+
+        Arguments:
+            items (Iterable[Union[dict, str]]): The results to log, each of
+                which is handled the same way as the `results` arg of `log`
+            tags (List[str]): Tags to apply to every one of the results
+            jobtext (str): The job text to record for every one of the results
+
+        Returns:
+            Bool: True if successful.
+
+        """
+        if self._readonly:
+            raise ValueError("Cannot log to a Wallaby opened with readonly=True.")
+        rows = [self._row(results, tags, jobtext) for results in items]
+        with self._transaction():
+            self._insert(rows)
         return True
 
+    def _select(
+        self,
+        query: str,
+        params: tuple = (),
+        as_dataframe: bool = False,
+        as_arrow: bool = False,
+        downcast: bool = False,
+    ):
+        if as_arrow:
+            results = self._read_arrow(query, params, as_dataframe=as_dataframe)
+        elif as_dataframe:
+            # Build the frame a chunk at a time, so that only one chunk of
+            # rows is ever held as Python tuples:
+            cursor = self._execute(query, params)
+            columns = [d[0] for d in cursor.description]
+            frames = [
+                pd.DataFrame(chunk, columns=columns) for chunk in _iter_chunks(cursor)
+            ]
+            if frames:
+                results = pd.concat(frames, ignore_index=True)
+            else:
+                results = pd.DataFrame([], columns=columns)
+        else:
+            results = self._execute(query, params).fetchall()
+        if as_dataframe and downcast:
+            return _downcast(results)
+        return results
+
+    def _read_arrow(self, query: str, params: tuple = (), as_dataframe: bool = False):
+        """
+        Run a query through connectorx, loading the rows as columnar Arrow data.
+
+        This skips building a Python tuple per row, which is much faster and
+        lighter on memory for large result sets. It requires the optional
+        `connectorx` package and an on-disk database.
+
+        Arguments:
+            query (str): The SQL query, with `?` placeholders
+            params (tuple): The values to bind to the placeholders
+            as_dataframe (bool: False): Whether to convert to an Arrow-backed
+                DataFrame
+
+        Returns:
+            pyarrow.Table: The results, or a DataFrame if as_dataframe is set
+
+        """
+        try:
+            import connectorx
+        except ImportError as e:
+            raise ImportError(
+                "Loading results as Arrow requires connectorx: "
+                "pip install connectorx"
+            ) from e
+
+        if params:
+            # connectorx cannot bind parameters, so have SQLite render them as
+            # safely quoted literals and splice them in:
+            literals = self._execute(
+                "SELECT " + ", ".join(["quote(?)"] * len(params)), params
+            ).fetchone()
+            pieces = query.split("?")
+            query = pieces[0] + "".join(
+                literal + piece for literal, piece in zip(literals, pieces[1:])
+            )
+
+        # Make sure connectorx sees everything written on this connection:
+        self.commit()
+        table = connectorx.read_sql(
+            "sqlite://" + os.path.abspath(self._sqlite_database_path),
+            query,
+            return_type="arrow",
+        )
+        if as_dataframe:
+            return table.to_pandas(types_mapper=pd.ArrowDtype)
+        return table
+
+    def _projection(self, columns: List[str] = None, load_results: bool = True) -> str:
+        """
+        Build the column list of a SELECT on the results table.
+
+        Arguments:
+            columns (List[str]): The columns to select. Defaults to all
+            load_results (bool: True): Whether the default includes the
+                (potentially large) results column. Ignored if columns is set
+
+        Returns:
+            str: The comma-separated column list
+
+        """
+        known = ["id", *self._columns.keys()]
+        if columns is None:
+            columns = [c for c in known if load_results or c != "results"]
+        elif isinstance(columns, str):
+            columns = [columns]
+        unknown = [c for c in columns if c not in known]
+        if unknown:
+            raise ValueError(f"Unknown columns {unknown}; expected some of {known}.")
+        return ", ".join(columns)
+
+    def _by_tag_query(
+        self,
+        all_of: Union[List[str], str] = None,
+        any_of: Union[List[str], str] = None,
+        since: float = None,
+        columns: List[str] = None,
+        load_results: bool = False,
+    ) -> Tuple[str, tuple]:
+        tag_clause, tag_params = _tag_query(all_of=all_of, any_of=any_of)
+        predicates = [(_RANK_SUBQUERY, f"id IN ({tag_clause})", tag_params)]
+        if since is not None:
+            predicates.append((_RANK_RANGE, "date > ?", (since,)))
+        where, params = _where(predicates)
+        projection = self._projection(columns, load_results)
+        return f"SELECT {projection} FROM results WHERE {where}", params
+
+    def _since_query(
+        self, since: float, columns: List[str] = None
+    ) -> Tuple[str, tuple]:
+        where, params = _where([(_RANK_RANGE, "date > ?", (since,))])
+        projection = self._projection(columns)
+        return f"SELECT {projection} FROM results WHERE {where}", params
+
     def get_by_tag(
         self,
         all_of: Union[List[str], str] = None,
         any_of: Union[List[str], str] = None,
         as_dataframe: bool = False,
+        as_arrow: bool = False,
+        downcast: bool = False,
+        columns: List[str] = None,
+        load_results: bool = False,
+        since: float = None,
     ) -> List[tuple]:
         """
         Query for a list of results based upon the tag.
@@ -98,35 +959,129 @@ class Wallaby:
             any_of (Union[List[str], str]): If any tag in this list is included
                 then the row will be returned.
             as_dataframe (bool: False): Whether to return results as DataFrame.
+            as_arrow (bool: False): Whether to load results columnar via Arrow.
+                See `_read_arrow`.
+            downcast (bool: False): Whether to shrink the DataFrame's numeric
+                columns to the narrowest dtype that holds them losslessly.
+            columns (List[str]): Which columns to return. Defaults to all
+                columns except `results` (see load_results).
+            load_results (bool: False): Whether to include the `results`
+                column, which holds the logged JSON, when columns is not set.
+                Leaving it out avoids reading large results from disk.
+            since (float): If set, only return results logged after this
+                time, e.g. time.time() - 3600.
+
+        Tags match case-insensitively. A tag ending in `*` (e.g. "sweep.*")
+        matches every tag with that prefix using an indexed range scan; all
+        other tags are matched with an indexed equality lookup. The empty tag
+        "" matches results that were logged without any tags.
 
         Returns:
             List[tuple]: A list of SQL rows
 
         """
-        if all_of:
-            set_operation = " AND "
-        elif any_of:
-            set_operation = " OR "
-        else:
-            raise ValueError("You must specify exactly one of `any_of` or `all_of`.")
+        return self._select(
+            *self._by_tag_query(
+                all_of=all_of,
+                any_of=any_of,
+                since=since,
+                columns=columns,
+                load_results=load_results,
+            ),
+            as_dataframe=as_dataframe,
+            as_arrow=as_arrow,
+            downcast=downcast,
+        )
 
-        taglist = all_of if all_of else any_of
+    def iter_by_tag(
+        self,
+        all_of: Union[List[str], str] = None,
+        any_of: Union[List[str], str] = None,
+        chunk_size: int = _FETCH_CHUNK_SIZE,
+        columns: List[str] = None,
+        load_results: bool = False,
+        since: float = None,
+    ) -> Iterator[tuple]:
+        """
+        Iterate over results based upon the tag, without loading them all.
+
+        Rows are fetched from SQLite `chunk_size` at a time. See `get_by_tag`
+        for how tags are matched and which columns are returned.
+
+        Arguments:
+            all_of (Union[List[str], str]): A list of tags to search for, all
+                of which must be included in order for the row to be returned
+            any_of (Union[List[str], str]): If any tag in this list is included
+                then the row will be returned.
+            chunk_size (int): How many rows to fetch at a time
+            columns (List[str]): Which columns to return
+            load_results (bool: False): Whether to include the `results`
+                column when columns is not set
+            since (float): If set, only return results logged after this time
+
+        Returns:
+            Iterator[tuple]: The SQL rows
 
-        if isinstance(taglist, str):
-            taglist = [taglist]
-        tag_clause = set_operation.join([f"tagscsv LIKE '%,{t},%'" for t in taglist])
-        results = self._execute(
-            f"""
-            SELECT * FROM results WHERE {tag_clause}
         """
-        ).fetchall()
-        if as_dataframe:
-            return pd.DataFrame(results, columns=["id", *self._columns.keys()])
-        else:
-            return results
+        query, params = self._by_tag_query(
+            all_of=all_of,
+            any_of=any_of,
+            since=since,
+            columns=columns,
+            load_results=load_results,
+        )
+        for chunk in _iter_chunks(self._execute(query, params), chunk_size):
+            yield from chunk
+
+    def get_by_exact_tagset(
+        self,
+        tags: List[str],
+        as_dataframe: bool = False,
+        columns: List[str] = None,
+        load_results: bool = False,
+    ) -> List[tuple]:
+        """
+        Query for results tagged with exactly this set of tags, and no others.
+
+        This is an index lookup on the hash of the (sorted, case-insensitive)
+        tag set, rather than one lookup per tag as in `get_by_tag`.
+
+        Arguments:
+            tags (List[str]): The tags. Order and duplicates do not matter
+            as_dataframe (bool: False): Whether to return results as DataFrame.
+            columns (List[str]): Which columns to return. Defaults to all
+                columns except `results` (see load_results).
+            load_results (bool: False): Whether to include the `results`
+                column when columns is not set.
+
+        Returns:
+            List[tuple]: A list of SQL rows
+
+        """
+        if isinstance(tags, str):
+            tags = [tags]
+        tagscsv = _canonical_tagscsv(tags)
+        where, params = _where(
+            [
+                (_RANK_EQUALITY, "tagset_hash = ?", (_tagset_hash(tagscsv),)),
+                # Rule out hash collisions:
+                (_RANK_SCAN, "tagscsv = ? COLLATE NOCASE", (tagscsv,)),
+            ]
+        )
+        projection = self._projection(columns, load_results)
+        return self._select(
+            f"SELECT {projection} FROM results WHERE {where}",
+            params,
+            as_dataframe=as_dataframe,
+        )
 
     def get_results_since(
-        self, since: float, as_dataframe: bool = False
+        self,
+        since: float,
+        as_dataframe: bool = False,
+        as_arrow: bool = False,
+        downcast: bool = False,
+        columns: List[str] = None,
     ) -> List[tuple]:
         """
         Get all results since a timestamp.
@@ -134,40 +1089,99 @@ class Wallaby:
         Arguments:
             since (float): The since-time, e.g. time.time()
             as_dataframe (bool: False): Whether to return results as DataFrame.
+            as_arrow (bool: False): Whether to load results columnar via Arrow.
+                See `_read_arrow`.
+            downcast (bool: False): Whether to shrink the DataFrame's numeric
+                columns to the narrowest dtype that holds them losslessly.
+            columns (List[str]): Which columns to return. Defaults to all.
 
         Returns:
             List[tuple]: A list of SQL rows
 
         """
-        results = self._execute(
-            """
-            SELECT * FROM results WHERE date > (?)
-        """,
-            (since,),
-        ).fetchall()
-        if as_dataframe:
-            return pd.DataFrame(results, columns=["id", *self._columns.keys()])
-        else:
-            return results
+        return self._select(
+            *self._since_query(since, columns=columns),
+            as_dataframe=as_dataframe,
+            as_arrow=as_arrow,
+            downcast=downcast,
+        )
 
-    def raw_query(self, query: str, as_dataframe: bool = False) -> List[tuple]:
+    def iter_results_since(
+        self,
+        since: float,
+        chunk_size: int = _FETCH_CHUNK_SIZE,
+        columns: List[str] = None,
+    ) -> Iterator[tuple]:
+        """
+        Iterate over all results since a timestamp, without loading them all.
+
+        Arguments:
+            since (float): The since-time, e.g. time.time()
+            chunk_size (int): How many rows to fetch at a time
+            columns (List[str]): Which columns to return. Defaults to all.
+
+        Returns:
+            Iterator[tuple]: The SQL rows
+
+        """
+        query, params = self._since_query(since, columns=columns)
+        for chunk in _iter_chunks(self._execute(query, params), chunk_size):
+            yield from chunk
+
+    def raw_query(
+        self,
+        query: str,
+        as_dataframe: bool = False,
+        as_arrow: bool = False,
+        downcast: bool = False,
+    ) -> List[tuple]:
         """
         Allow a raw query against the database.
 
+        Writes made this way are committed immediately, unless a transaction
+        was opened with `raw_query("BEGIN")`; in that case, call `commit`.
+
         Arguments:
             query (str): A SQL query against the table
             as_dataframe (bool: False): Whether to return results as DataFrame
+            as_arrow (bool: False): Whether to load results columnar via Arrow
+            downcast (bool: False): Whether to shrink the DataFrame's numeric
+                columns to the narrowest dtype that holds them losslessly
 
         Returns:
             List[tuple]: A list of rows
 
         """
-        results = self._execute(query)
-
-        if as_dataframe:
-            return pd.DataFrame(results, columns=["id", *self._columns.keys()])
+        if as_arrow:
+            results = self._read_arrow(query, as_dataframe=as_dataframe)
         else:
-            return results
+            results = self._execute(query)
+            if as_dataframe:
+                columns = [d[0] for d in results.description]
+                results = pd.DataFrame(results, columns=columns)
+        if as_dataframe and downcast:
+            return _downcast(results)
+        return results
+
+
+def _tee(stream: BinaryIO) -> bytearray:
+    """
+    Copy a binary stream to stdout as it arrives, and collect it.
+
+    Arguments:
+        stream (BinaryIO): A buffered binary stream, e.g. a subprocess pipe
+
+    Returns:
+        bytearray: Everything that was read from the stream
+
+    """
+    collected = bytearray()
+    stdout = sys.stdout.buffer
+    for chunk in iter(lambda: stream.read1(_TEE_CHUNK_SIZE), b""):
+        stdout.write(chunk)
+        stdout.flush()
+        collected += chunk
+    return collected
 
 
 def cli():
@@ -186,18 +1200,26 @@ def cli():
 
     environment = dict(os.environ)
 
-    if not sys.stdin.isatty():
-        stdin = sys.stdin.read()
-    else:
-        stdin = ""
-
     if args.command:
-        p = subprocess.check_output(
-            args.command, shell=True, env=environment, input=stdin
+        # Hand our stdin straight to the command (or nothing, if it is a
+        # terminal), and echo its output as it arrives rather than buffering
+        # it all first:
+        p = subprocess.Popen(
+            args.command,
+            shell=True,
+            env=environment,
+            stdin=subprocess.DEVNULL if sys.stdin.isatty() else None,
+            stdout=subprocess.PIPE,
         )
-        output = p.decode()
+        with p:
+            output = _tee(p.stdout)
+        if p.returncode:
+            raise subprocess.CalledProcessError(p.returncode, args.command, output)
+        output = output.decode()
+    elif not sys.stdin.isatty():
+        output = _tee(sys.stdin.buffer).decode()
     else:
-        output = stdin
+        output = ""
 
     # Construct a nicely organized results dict of this execution:
     result = {
@@ -210,7 +1232,6 @@ def cli():
 
     w = Wallaby(args.database_file)
     w.log(result, tags=["cli", *other_tags], jobtext=args.command or None)
-    print(output, end="")
 
 
 def wallaby2json():
@@ -227,15 +1248,57 @@ def wallaby2json():
     parser.add_argument("-f", "--database-file", default=_DEFAULT_SQLITE_PATH)
     args = parser.parse_args()
 
-    w = Wallaby(args.database_file)
+    w = Wallaby(args.database_file, readonly=True)
     all_tags = args.all_tags.split(",")
-    res = w.get_by_tag(all_of=all_tags, as_dataframe=True)
-    res.results = res.results.map(lambda x: json.loads(x))
-    res = res.join(pd.json_normalize(res.results))
-    res.drop(columns="results", inplace=True)
-    if not args.include_env:
-        res.drop(
-            columns=[col for col in res.columns if col.startswith("environment.")],
-            inplace=True,
-        )
+    tag_clause, tag_params = _tag_query(all_of=all_tags)
+
+    # Let SQLite flatten the results JSON rather than parsing every row in
+    # Python: first discover the leaf paths (in first-seen order, skipping
+    # array elements, like pd.json_normalize), then json_extract each one.
+    # json_extract turns booleans into 1/0 and arrays into JSON text, so
+    # paths that ever hold those are fetched as JSON (`->`) and parsed.
+    paths = w._execute(
+        f"""
+        SELECT t.fullkey, MAX(t.type IN ('true', 'false', 'array'))
+        FROM results, json_tree(results.results) AS t
+        WHERE results.id IN ({tag_clause})
+            AND t.type != 'object'
+            AND instr(t.fullkey, '[') = 0
+        GROUP BY t.fullkey
+        ORDER BY MIN(results.id), MIN(t.id)
+    """,
+        tag_params,
+    ).fetchall()
+    columns = {}
+    for path, as_json in paths:
+        name = path[2:].replace('"', "")
+        if args.include_env or not name.startswith("environment."):
+            columns[name] = (path, as_json)
+
+    # json_extract returns booleans as 0/1 and arrays as text, so read those
+    # columns as JSON instead. (The -> operator would do this, but it needs
+    # SQLite 3.38+.)
+    as_json_extract = """, CASE json_type(results, ?)
+        WHEN 'true' THEN 'true' WHEN 'false' THEN 'false'
+        ELSE json_quote(json_extract(results, ?)) END"""
+    extracts = "".join(
+        as_json_extract if as_json else ", json_extract(results, ?)"
+        for _, as_json in columns.values()
+    )
+    extract_params = [
+        param
+        for path, as_json in columns.values()
+        for param in ((path, path) if as_json else (path,))
+    ]
+    rows = w._execute(
+        f"""
+        SELECT id, jobtext, tagscsv, date{extracts}
+        FROM results WHERE id IN ({tag_clause})
+    """,
+        (*extract_params, *tag_params),
+    ).fetchall()
+    res = pd.DataFrame(rows, columns=["id", "jobtext", "tagscsv", "date", *columns])
+    for name, (_, as_json) in columns.items():
+        if as_json:
+            res[name] = res[name].map(_json_loads, na_action="ignore")
     print(res.to_json())
@@ -1,4 +1,11 @@
-from . import Wallaby
+from . import Wallaby, _thread_conns, wallaby2json
+import json
+import os
+import pytest
+import sqlite3
+import subprocess
+import sys
+import threading
 import time
 
 class TestWallaby:
@@ -29,3 +36,269 @@ class TestWallaby:
         assert len(w.get_by_tag(all_of=["foob"])) == 0
         assert len(w.get_by_tag(any_of=["baz"])) == 0
         assert len(w.get_by_tag(all_of=["foo", "bar"])) == 1
+
+    def test_get_by_tag_is_case_insensitive_and_parameterized(self, tmp_path):
+        w = Wallaby(str(tmp_path / "wallaby.db"))
+        w.log("quoted", tags=["it's", "Baz"])
+        assert len(w.get_by_tag(all_of=["IT'S", "baz"])) == 1
+        assert len(w.get_by_tag(any_of=["x' OR '1'='1"])) == 0
+
+    def test_get_by_tag_prefix(self, tmp_path):
+        w = Wallaby(str(tmp_path / "wallaby.db"))
+        w.log("a", tags=["sweep.lr", "gpu"])
+        w.log("b", tags=["Sweep.batch"])
+        w.log("c", tags=["sweeper"])
+        assert len(w.get_by_tag(any_of=["sweep.*"])) == 2
+        assert len(w.get_by_tag(all_of=["sweep.*", "gpu"])) == 1
+        assert len(w.get_by_tag(any_of=["*"])) == 3
+
+    def test_get_by_tag_non_ascii_prefix(self, tmp_path):
+        w = Wallaby(str(tmp_path / "wallaby.db"))
+        w.log("a", tags=["Äpfel"])
+        assert len(w.get_by_tag(all_of=["Äp*"])) == 1
+        assert len(w.get_by_tag(all_of=["ÄP*"])) == 1
+        assert len(w.get_by_tag(all_of=["Äpfel"])) == 1
+
+    def test_can_log_many(self, tmp_path):
+        w = Wallaby(str(tmp_path / "wallaby.db"))
+        assert w.log_many([{"i": i} for i in range(10)], tags=["batch"]) == True
+        assert len(w.get_by_tag(all_of=["batch"])) == 10
+
+    def test_bulk_mode_restores_pragmas(self, tmp_path):
+        w = Wallaby(str(tmp_path / "wallaby.db"))
+        with w.bulk_mode():
+            w.log_many(["x"] * 5)
+            assert w.raw_query("PRAGMA journal_mode").fetchone()[0] == "off"
+        assert w.raw_query("PRAGMA journal_mode").fetchone()[0] == "delete"
+        assert len(w.get_results_since(0)) == 5
+
+    def test_wal_is_opt_in(self, tmp_path):
+        w = Wallaby(str(tmp_path / "default.db"))
+        assert w.raw_query("PRAGMA journal_mode").fetchone()[0] == "delete"
+        w = Wallaby(str(tmp_path / "wal.db"), wal=True)
+        assert w.raw_query("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    def test_can_get_as_arrow(self, tmp_path):
+        pytest.importorskip("connectorx")
+        w = Wallaby(str(tmp_path / "wallaby.db"))
+        w.log({"favorite_number": 42}, tags=["it's"])
+        table = w.get_by_tag(all_of=["it's"], as_arrow=True)
+        assert table.num_rows == 1
+        df = w.get_results_since(0, as_arrow=True, as_dataframe=True)
+        assert "42" in df.results.iloc[0]
+
+    def test_orjson_falls_back_to_json(self, tmp_path):
+        pytest.importorskip("orjson")
+        w = Wallaby(str(tmp_path / "wallaby.db"))
+        assert w.log({"big": 2**70, "env": "\udcff"}) == True
+        results = json.loads(w.get_results_since(0)[0][4])
+        assert results == {"big": 2**70, "env": "\udcff"}
+
+    def test_can_downcast_dataframe(self, tmp_path):
+        w = Wallaby(str(tmp_path / "wallaby.db"))
+        w.log("result")
+        df = w.get_results_since(0, as_dataframe=True, downcast=True)
+        assert df.id.dtype == "uint8"
+        assert df.date.iloc[0] > 0
+
+    def test_wallaby2json_flattens_results(self, tmp_path, monkeypatch, capsys):
+        path = str(tmp_path / "wallaby.db")
+        w = Wallaby(path)
+        w.log(
+            {
+                "a": 1,
+                "b": {"c": 2},
+                "flag": True,
+                "arr": [1, 2],
+                "environment": {"HOME": "/"},
+            },
+            tags=["foo"],
+        )
+        monkeypatch.setattr("sys.argv", ["wallaby2json", "-t", "foo", "-f", path])
+        wallaby2json()
+        out = json.loads(capsys.readouterr().out)
+        assert out["a"] == {"0": 1}
+        assert out["b.c"] == {"0": 2}
+        assert out["flag"] == {"0": True}
+        assert out["arr"] == {"0": [1, 2]}
+        assert "environment.HOME" not in out
+
+    def test_can_iter_by_tag(self, tmp_path):
+        w = Wallaby(str(tmp_path / "wallaby.db"))
+        w.log_many([{"i": i} for i in range(25)], tags=["stream"])
+        assert len(list(w.iter_by_tag(all_of=["stream"], chunk_size=10))) == 25
+        assert len(list(w.iter_results_since(0, chunk_size=10))) == 25
+        assert len(w.get_by_tag(all_of=["stream"], as_dataframe=True)) == 25
+        assert len(w.get_by_tag(all_of=["nope"], as_dataframe=True)) == 0
+
+    def test_readonly(self, tmp_path):
+        path = str(tmp_path / "wallaby.db")
+        Wallaby(path).log("written", tags=["ro"])
+        r = Wallaby(path, readonly=True)
+        assert len(r.get_by_tag(all_of=["ro"])) == 1
+        with pytest.raises(ValueError):
+            r.log("not written")
+
+    def test_get_by_tag_projects_columns(self, tmp_path):
+        w = Wallaby(str(tmp_path / "wallaby.db"))
+        w.log({"favorite_number": 42}, tags=["proj"])
+        df = w.get_by_tag(all_of=["proj"], as_dataframe=True)
+        assert "results" not in df.columns
+        df = w.get_by_tag(all_of=["proj"], as_dataframe=True, load_results=True)
+        assert "42" in df.results.iloc[0]
+        assert w.get_by_tag(all_of=["proj"], columns=["id", "date"])[0][0] == 1
+        with pytest.raises(ValueError):
+            w.get_by_tag(all_of=["proj"], columns=["id; DROP TABLE results"])
+
+    def test_get_by_tag_since(self, tmp_path):
+        w = Wallaby(str(tmp_path / "wallaby.db"))
+        w.log("old", tags=["since"])
+        cutoff = time.time()
+        w.log("new", tags=["since"])
+        assert len(w.get_by_tag(all_of=["since"])) == 2
+        assert len(w.get_by_tag(all_of=["since"], since=cutoff)) == 1
+
+    def test_rows_do_not_include_tagset_hash(self, tmp_path):
+        w = Wallaby(str(tmp_path / "wallaby.db"))
+        w.log("result", tags=["foo"])
+        assert len(w.get_results_since(0)[0]) == 5
+        assert "tagset_hash" not in w.get_by_tag("foo", as_dataframe=True).columns
+
+    def test_get_by_exact_tagset(self, tmp_path):
+        w = Wallaby(str(tmp_path / "wallaby.db"))
+        w.log("both", tags=["foo", "bar"])
+        w.log("more", tags=["foo", "bar", "baz"])
+        w.log("one", tags=["foo"])
+        assert len(w.get_by_exact_tagset(["Bar", "foo", "foo"])) == 1
+        assert len(w.get_by_exact_tagset(["foo"])) == 1
+        assert len(w.get_by_exact_tagset(["baz"])) == 0
+
+    def test_exact_tagset_folds_case_in_ascii_only(self, tmp_path):
+        w = Wallaby(str(tmp_path / "wallaby.db"))
+        w.log("a", tags=["Éclair", "b"])
+        w.log("c", tags=["Éclair", "éclair"])
+        assert len(w.get_by_exact_tagset(["Éclair", "B"])) == 1
+        assert len(w.get_by_exact_tagset(["éclair", "b"])) == 0
+        assert len(w.get_by_exact_tagset(["éclair", "Éclair"])) == 1
+        assert len(w.get_by_tag(all_of=["éclair"])) == 1
+
+    def test_get_by_empty_tag_returns_untagged(self, tmp_path):
+        w = Wallaby(str(tmp_path / "wallaby.db"))
+        w.log("untagged")
+        w.log("tagged", tags=["foo"])
+        assert [r[0] for r in w.get_by_tag(all_of=[""])] == [1]
+        assert len(w.get_by_tag(any_of=["", "foo"])) == 2
+        query, params = w._by_tag_query(all_of=[""])
+        plan = " ".join(
+            row[-1] for row in w._execute("EXPLAIN QUERY PLAN " + query, params)
+        )
+        assert "SCAN tags" not in plan
+        assert "results_tagset_hash_idx" in plan
+
+    def test_close_releases_connection(self, tmp_path):
+        path = str(tmp_path / "wallaby.db")
+        w = Wallaby(path)
+        w.log("first")
+        w.close()
+        os.remove(path)
+        # Recreated databases are provisioned again:
+        w = Wallaby(path)
+        assert w.log("second") == True
+        assert len(w.get_results_since(0)) == 1
+
+    def test_queries_do_not_resolve_path(self, tmp_path, monkeypatch):
+        w = Wallaby(str(tmp_path / "wallaby.db"))
+        w.log("first")
+
+        def fail(path):
+            raise AssertionError("path resolved on a query")
+
+        monkeypatch.setattr(os.path, "realpath", fail)
+        w.log("second")
+        assert len(w.get_results_since(0)) == 2
+
+    def test_connections_are_per_thread(self, tmp_path):
+        w = Wallaby(str(tmp_path / "wallaby.db"))
+        thread = threading.Thread(target=lambda: w.log("from a thread"))
+        thread.start()
+        thread.join()
+        assert len(w.get_results_since(0)) == 1
+
+    def test_log_inside_caller_transaction(self, tmp_path):
+        w = Wallaby(str(tmp_path / "wallaby.db"))
+        w.raw_query("BEGIN")
+        w.log("rolled back")
+        w.raw_query("ROLLBACK")
+        w.raw_query("BEGIN")
+        w.log_many(["kept", "also kept"])
+        w.commit()
+        results = [r[0] for r in w.get_results_since(0, columns=["results"])]
+        assert len(results) == 2
+        assert all("kept" in r for r in results)
+
+    def test_readonly_provisions_old_or_missing_database(self, tmp_path):
+        path = str(tmp_path / "old.db")
+        # The schema written by the first version of Wallaby:
+        conn = sqlite3.connect(path)
+        conn.execute(
+            "CREATE TABLE results (id INTEGER PRIMARY KEY, "
+            "jobtext TEXT, tagscsv TEXT, date FLOAT, results JSON)"
+        )
+        conn.execute(
+            "INSERT INTO results(jobtext, tagscsv, date, results) "
+            "VALUES('job', ',foo,', 1.0, '{\"a\": 1}')"
+        )
+        conn.commit()
+        conn.close()
+        r = Wallaby(path, readonly=True)
+        assert len(r.get_by_tag(all_of=["foo"])) == 1
+        assert len(r.get_by_exact_tagset(["foo"])) == 1
+
+        missing = str(tmp_path / "missing.db")
+        assert Wallaby(missing, readonly=True).get_results_since(0) == []
+
+    def test_readonly_checks_schema_once(self, tmp_path, monkeypatch):
+        path = str(tmp_path / "missing.db")
+        Wallaby(path, readonly=True)
+        # The check is cached, and no read-write connection is left open:
+        monkeypatch.setattr(Wallaby, "_initialize", None)
+        monkeypatch.setattr(Wallaby, "_execute", None)
+        assert Wallaby(path, readonly=True)._schema_is_current()
+        assert (os.path.realpath(path), False, False) not in _thread_conns()
+
+
+def _run_cli(args, stdin=b""):
+    # Run the `wallaby` entry point in a fresh interpreter, as a user would:
+    return subprocess.run(
+        [sys.executable, "-c", "import wallaby; wallaby.cli()", *args],
+        input=stdin,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+
+
+class TestCli:
+    def test_command_output_is_echoed_and_logged(self, tmp_path):
+        path = str(tmp_path / "wallaby.db")
+        p = _run_cli(["-c", "echo hello", "-t", "foo", "-f", path])
+        assert p.returncode == 0
+        assert p.stdout == b"hello\n"
+        rows = Wallaby(path).get_by_tag(all_of=["cli", "foo"], load_results=True)
+        assert len(rows) == 1
+        assert json.loads(rows[0][4])["output"] == "hello\n"
+
+    def test_piped_stdin_is_echoed_and_logged(self, tmp_path):
+        path = str(tmp_path / "wallaby.db")
+        p = _run_cli(["-f", path], stdin=b"piped\n")
+        assert p.returncode == 0
+        assert p.stdout == b"piped\n"
+        rows = Wallaby(path).get_by_tag(all_of=["cli"], load_results=True)
+        assert json.loads(rows[0][4])["output"] == "piped\n"
+
+    def test_failing_command_raises_without_logging(self, tmp_path):
+        path = str(tmp_path / "wallaby.db")
+        p = _run_cli(["-c", "echo partial; exit 3", "-f", path])
+        assert p.returncode != 0
+        assert b"CalledProcessError" in p.stderr
+        assert Wallaby(path).get_results_since(0) == []